@@ -1,3 +1,4 @@
+import logging
 import tomllib
 from pathlib import Path
 
@@ -29,3 +30,15 @@ class Config:
     @property
     def fetch_interval_minutes(self) -> int:
         return self.data['fetch_interval_minutes']
+
+    @property
+    def web_workers(self) -> int:
+        return self.data.get('web_workers', 1)
+
+
+def setup_logging() -> None:
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s %(levelname)s %(message)s',
+        datefmt='%Y-%m-%d %H:%M:%S',
+    )
@@ -1,27 +1,65 @@
+import asyncio
+import logging
+import os
+import time
+from pathlib import Path
+
 from tortoise import Tortoise, fields
+from tortoise.exceptions import OperationalError
 from tortoise.fields import ForeignKeyRelation
 from tortoise.models import Model
 
+UPDATE_STAMP_PATH = Path('data', 'update.stamp')
+SCHEMA_WAIT_SECONDS = 5
+
 
-async def init_db(package_name: str) -> None:
+async def init_db(package_name: str, read_only: bool = False) -> None:
     await Tortoise.init(
         db_url='sqlite://data/db.sqlite3',
         modules={'models': [f'{package_name}.db']}
     )
-    await Tortoise.generate_schemas()
-    await Group.all().count()  # test connection
+    if read_only:
+        # schema and all writes are owned by the fetch process
+        await Tortoise.get_connection('default').execute_script('PRAGMA query_only = ON')
+    else:
+        await Tortoise.generate_schemas()
+    while True:
+        try:
+            await Group.all().count()  # test connection
+            return
+        except OperationalError as e:
+            if not read_only:
+                raise
+            logging.warning(f'DB schema is not ready, waiting for `main.py fetch` to create it: {e!r}')
+            await asyncio.sleep(SCHEMA_WAIT_SECONDS)
 
 
 async def close_db() -> None:
     await Tortoise.close_connections()
 
 
+def mark_updated() -> None:
+    """Bump update stamp, so other processes know that db content was changed."""
+    tmp_path = UPDATE_STAMP_PATH.with_suffix('.tmp')
+    tmp_path.write_text(str(time.time_ns()))
+    os.replace(tmp_path, UPDATE_STAMP_PATH)
+
+
+def get_update_stamp() -> str:
+    # compare content instead of mtime, which can be too coarse on some filesystems
+    try:
+        return UPDATE_STAMP_PATH.read_text()
+    except FileNotFoundError:
+        return ''
+
+
 class Group(Model):
     id = fields.UUIDField(pk=True)
     name = fields.CharField(max_length=256)
     updated = fields.DatetimeField(index=True)
     threads: fields.ReverseRelation['Thread']
     messages: fields.ReverseRelation['Message']
+    series: fields.ReverseRelation['Series']
 
 
 class Thread(Model):
@@ -38,7 +76,7 @@ class Message(Model):
     id = fields.UUIDField(pk=True)
     group: ForeignKeyRelation['Group'] = fields.ForeignKeyField('models.Group', related_name='messages')
     thread: ForeignKeyRelation['Thread'] | None = fields.ForeignKeyField('models.Thread', related_name='messages', null=True)
-    reply_to = fields.CharField(max_length=256, null=True)
+    reply_to = fields.CharField(max_length=256, null=True, index=True)
     msg_id = fields.CharField(max_length=256, unique=True, index=True)
     sender = fields.CharField(max_length=256)
     subject = fields.CharField(max_length=256)
@@ -46,6 +84,8 @@ class Message(Model):
     headers = fields.TextField()
     body = fields.TextField()
     created = fields.DatetimeField(index=True)
+    series_messages: fields.ReverseRelation['SeriesMessage']
+    authors: fields.ReverseRelation['MessageAuthor']
 
     def __repr__(self):
         return f'<Message {self.id}>'
@@ -58,3 +98,56 @@ class Reference(Model):
 
     def __repr__(self):
         return f'<Reference {self.id}>'
+
+
+class Series(Model):
+    id = fields.UUIDField(pk=True)
+    group: ForeignKeyRelation['Group'] = fields.ForeignKeyField('models.Group', related_name='series')
+    subject = fields.CharField(max_length=256)
+    subject_normalized = fields.CharField(max_length=256)
+    prefix = fields.CharField(max_length=256)
+    version = fields.IntField()
+    sender_address = fields.CharField(max_length=256, index=True)
+    created = fields.DatetimeField(index=True)
+    updated = fields.DatetimeField(index=True)
+    messages: fields.ReverseRelation['SeriesMessage']
+
+    class Meta:
+        indexes = (('group', 'subject_normalized', 'sender_address'),)
+
+    def __repr__(self):
+        return f'<Series {self.id}>'
+
+
+class SeriesMessage(Model):
+    id = fields.UUIDField(pk=True)
+    series: ForeignKeyRelation['Series'] = fields.ForeignKeyField('models.Series', related_name='messages')
+    message: ForeignKeyRelation['Message'] = fields.ForeignKeyField(
+        'models.Message',
+        related_name='series_messages',
+        index=True,
+    )
+    version = fields.IntField()
+    index = fields.IntField(null=True)
+    total = fields.IntField(null=True)
+    cover_msg_id = fields.CharField(max_length=256, null=True)
+    created = fields.DatetimeField()
+
+    class Meta:
+        indexes = (('series', 'version', 'index'),)
+
+    def __repr__(self):
+        return f'<SeriesMessage {self.id}>'
+
+
+class MessageAuthor(Model):
+    id = fields.UUIDField(pk=True)
+    message: ForeignKeyRelation['Message'] = fields.ForeignKeyField('models.Message', related_name='authors')
+    address = fields.CharField(max_length=256)
+    created = fields.DatetimeField()
+
+    class Meta:
+        indexes = (('address', 'created'),)
+
+    def __repr__(self):
+        return f'<MessageAuthor {self.id}>'
@@ -1,13 +1,27 @@
+import asyncio
 import logging
 import re
 from collections import defaultdict
 from datetime import datetime
-from uuid import uuid4
+from email.utils import parseaddr
+from typing import NamedTuple
+from uuid import UUID, uuid4
 
+from tortoise.backends.base.client import BaseDBAsyncClient
+from tortoise.expressions import Subquery
 from tortoise.transactions import in_transaction
 
 from .async_nntplib import AsyncNNTP
-from .db import Group, Message, Reference, Thread
+from .config import Config
+from .db import Group, Message, MessageAuthor, Reference, Series, SeriesMessage, Thread, mark_updated
+
+
+class PatchInfo(NamedTuple):
+    prefix: str
+    version: int
+    index: int | None
+    total: int | None
+    title: str
 
 
 async def get_or_create_group(name: str) -> Group:
@@ -74,6 +88,165 @@ async def save_messages(messages: list[Message], references: list[Reference]) ->
         for group in groups:
             await group.save(update_fields=['updated'], using_db=transaction)
 
+        await index_messages(messages, transaction)
+    mark_updated()
+
+
+async def index_messages(messages: list[Message], transaction: BaseDBAsyncClient) -> None:
+    """Save author and patch series metadata for messages.
+
+    Numbered patches join the series of the message they reply to (cover letter or previous patch).
+    Cover letters, single patches and patches without known parent continue the series
+    with the same title and author, but only if it has lower version (or the same one for resend).
+    """
+    authors = []
+    patches = []
+    for message in messages:
+        address = normalize_address(message.sender)
+        authors.append(MessageAuthor(id=uuid4(), message_id=message.id, address=address, created=message.created))
+        info = parse_patch_subject(message.subject)
+        if info is not None:
+            patches.append((message, info, address))
+    # cover letters first, so patches can find them in the same batch
+    patches.sort(key=lambda patch: patch[1].index or 0)
+
+    series_messages = []
+    series_by_id: dict[UUID, Series] = {}
+    series_by_key: dict[tuple, Series] = {}
+    series_by_msg_id: dict[tuple, Series] = {}
+    series_by_thread: dict[tuple, Series] = {}
+    new_series = []
+    covers: dict[tuple, str] = {}
+    ingested_covers: dict[tuple, str] = {}
+    for message, info, address in patches:
+        series = None
+        if info.index:
+            if message.reply_to:
+                series = series_by_msg_id.get((message.reply_to, info.version))
+                if not series:
+                    parent = await SeriesMessage.filter(
+                        message__msg_id=message.reply_to,
+                        version=info.version,
+                    ).using_db(transaction).select_related('series').first()
+                    if parent:
+                        series = series_by_id.setdefault(parent.series_id, parent.series)
+            if not series:
+                series = series_by_thread.get((message.thread_id, info.version, info.total))
+        if not series:
+            key = (message.group_id, info.title.lower(), address)
+            max_version = info.version if 'resend' in info.prefix.lower().split() else info.version - 1
+            series = series_by_key.get(key)
+            if series and series.version > max_version:
+                series = None
+            if not series and max_version > 0:
+                series = await Series.filter(
+                    group_id=message.group_id,
+                    subject_normalized=info.title.lower(),
+                    sender_address=address,
+                    version__lte=max_version,
+                ).using_db(transaction).order_by('-updated').first()
+                if series:
+                    series = series_by_id.setdefault(series.id, series)
+            if not series:
+                series = Series(
+                    id=uuid4(),
+                    group_id=message.group_id,
+                    subject=info.title,
+                    subject_normalized=info.title.lower(),
+                    prefix=info.prefix,
+                    version=info.version,
+                    sender_address=address,
+                    created=message.created,
+                    updated=message.created,
+                )
+                new_series.append(series)
+                series_by_id[series.id] = series
+            series_by_key[key] = series
+        if info.version >= series.version:
+            series.version = info.version
+            series.prefix = info.prefix
+            if info.index in (None, 0):
+                series.subject = info.title
+        series.updated = max(series.updated, message.created)
+        series_by_msg_id[(message.msg_id, info.version)] = series
+        if info.total:
+            series_by_thread[(message.thread_id, info.version, info.total)] = series
+
+        cover_key = (series.id, info.version)
+        if info.index == 0:
+            covers[cover_key] = message.msg_id
+            ingested_covers[cover_key] = message.msg_id
+        elif cover_key not in covers and series not in new_series:
+            cover = await SeriesMessage.filter(
+                series_id=series.id,
+                version=info.version,
+                index=0,
+            ).using_db(transaction).first()
+            if cover:
+                covers[cover_key] = cover.cover_msg_id
+        series_messages.append(SeriesMessage(
+            id=uuid4(),
+            series_id=series.id,
+            message_id=message.id,
+            version=info.version,
+            index=info.index,
+            total=info.total,
+            created=message.created,
+        ))
+
+    for series_message in series_messages:
+        series_message.cover_msg_id = covers.get((series_message.series_id, series_message.version))
+
+    await Series.bulk_create(new_series, using_db=transaction)
+    await SeriesMessage.bulk_create(series_messages, using_db=transaction)
+    await MessageAuthor.bulk_create(authors, using_db=transaction)
+    for series in series_by_id.values():
+        if series not in new_series:
+            await series.save(update_fields=['subject', 'prefix', 'version', 'updated'], using_db=transaction)
+    # cover letter can arrive after patches of the same version
+    for (series_id, version), cover_msg_id in ingested_covers.items():
+        await attach_patches_to_cover(series_id, version, cover_msg_id, transaction)
+
+
+async def attach_patches_to_cover(
+    series_id: UUID,
+    version: int,
+    cover_msg_id: str,
+    transaction: BaseDBAsyncClient,
+) -> None:
+    """Move patches saved before their cover letter into its series and drop emptied series."""
+    orphan_series_ids = set(await SeriesMessage.filter(
+        message__reply_to=cover_msg_id,
+        version=version,
+    ).exclude(series_id=series_id).using_db(transaction).values_list('series_id', flat=True))
+    if orphan_series_ids:
+        await SeriesMessage.filter(
+            series_id__in=orphan_series_ids,
+            version=version,
+        ).using_db(transaction).update(series_id=series_id)
+    await SeriesMessage.filter(
+        series_id=series_id,
+        version=version,
+        cover_msg_id=None,
+    ).using_db(transaction).update(cover_msg_id=cover_msg_id)
+    for orphan_series_id in orphan_series_ids:
+        if not await SeriesMessage.filter(series_id=orphan_series_id).using_db(transaction).exists():
+            await Series.filter(id=orphan_series_id).using_db(transaction).delete()
+
+
+async def index_old_messages(chunk_size: int = 500) -> None:
+    """Build author and series indexes for messages saved before they were introduced."""
+    while True:
+        messages = await Message.filter(
+            id__not_in=Subquery(MessageAuthor.all().values('message_id')),
+        ).order_by('created').limit(chunk_size)
+        if not messages:
+            return
+        logging.info(f'Indexing {len(messages)} old messages')
+        async with in_transaction() as transaction:
+            await index_messages(messages, transaction)
+        mark_updated()
+
 
 def normalize_subject(subject: str) -> str:
     """Remove 're:' and 'fwd:' prefixes and patch numbers from subject.
@@ -93,6 +266,57 @@ def normalize_subject(subject: str) -> str:
     return subject
 
 
+def parse_patch_subject(subject: str) -> PatchInfo | None:
+    """Extract patch series metadata from subject, None for non-patches and replies.
+
+    >>> parse_patch_subject('[PATCH v3 02/10] rust: add  Foo')
+    PatchInfo(prefix='PATCH', version=3, index=2, total=10, title='rust: add Foo')
+    >>> parse_patch_subject('[RFC PATCH net-next 0/2] bar')
+    PatchInfo(prefix='RFC PATCH net-next', version=1, index=0, total=2, title='bar')
+    >>> parse_patch_subject('[PATCH] baz')
+    PatchInfo(prefix='PATCH', version=1, index=None, total=None, title='baz')
+    >>> parse_patch_subject('[Intel-wired-lan] [PATCH v2 1/3] ice: fix')
+    PatchInfo(prefix='PATCH', version=2, index=1, total=3, title='ice: fix')
+    >>> parse_patch_subject('[PATCHv2 1/3] foo')
+    PatchInfo(prefix='PATCH', version=2, index=1, total=3, title='foo')
+    >>> parse_patch_subject('Re: [PATCH v2 1/2] foo') is None
+    True
+    """
+    subject = re.sub(r'\s+', ' ', subject).strip()
+    match = re.match(r'((?:\[[^\]]*\] ?)+)(.*)', subject)
+    if not match:
+        return None
+    brackets, title = match.groups()
+    for tags in re.findall(r'\[([^\]]*)\]', brackets):
+        if re.search(r'\bpatch(v\d+)?\b', tags, re.IGNORECASE):
+            break
+    else:
+        return None
+    tags = re.sub(r'\b(patch)(v\d+)\b', r'\1 \2', tags, flags=re.IGNORECASE)
+    version = 1
+    index = total = None
+    prefix = []
+    for tag in tags.split():
+        if version_match := re.fullmatch(r'v(\d+)', tag, re.IGNORECASE):
+            version = int(version_match.group(1))
+        elif numbers_match := re.fullmatch(r'(\d+)/(\d+)', tag):
+            index, total = int(numbers_match.group(1)), int(numbers_match.group(2))
+        else:
+            prefix.append(tag)
+    return PatchInfo(' '.join(prefix), version, index, total, title)
+
+
+def normalize_address(sender: str) -> str:
+    """Extract lowercase email address from 'From' header.
+
+    >>> normalize_address('Benno Lossin <Benno.Lossin@proton.me>')
+    'benno.lossin@proton.me'
+    >>> normalize_address('viresh.kumar@linaro.org')
+    'viresh.kumar@linaro.org'
+    """
+    return parseaddr(sender)[1].lower()
+
+
 async def update_messages(groups_urls: list[str], fetch_new: int, fetch_old: int) -> None:
     groups_per_server = defaultdict(list)
     for group_url in groups_urls:
@@ -151,3 +375,17 @@ async def update_messages(groups_urls: list[str], fetch_new: int, fetch_old: int
         except Exception as e:
             logging.exception(f'Error fetching from {server}: {e!r}')
             raise
+
+
+async def scheduled_update() -> None:
+    config = Config()
+    try:
+        await index_old_messages()
+    except Exception as e:
+        logging.error(f'Error during indexing old messages: {e!r}')
+    while True:
+        try:
+            await update_messages(config.groups, config.fetch_new_count, config.fetch_count)
+        except Exception as e:
+            logging.error(f'Error during scheduled update: {e!r}')
+        await asyncio.sleep(config.fetch_interval_minutes * 60)
@@ -1,29 +1,46 @@
+import argparse
 import asyncio
-import logging
 import sys
 from pathlib import Path
 
 
-async def main(package_name: str) -> None:
-    logging.basicConfig(
-        level=logging.INFO,
-        format='%(asctime)s %(levelname)s %(message)s',
-        datefmt='%Y-%m-%d %H:%M:%S',
-    )
-
+async def run_fetch(package_name: str) -> None:
     from .db import close_db, init_db
-    from .web import run_web
+    from .fetcher import scheduled_update
 
     await init_db(package_name)
     try:
-        await run_web()
+        await scheduled_update()
     finally:
         await close_db()
 
 
+def main(package_name: str) -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        'mode',
+        nargs='?',
+        choices=['all', 'web', 'fetch'],
+        default='all',
+        help='all: single process with web and fetcher; web: read-only web workers; fetch: fetcher only',
+    )
+    args = parser.parse_args()
+
+    from .config import Config, setup_logging
+    from .web import run_web, run_web_workers
+
+    setup_logging()
+    if args.mode == 'fetch':
+        asyncio.run(run_fetch(package_name))
+    elif args.mode == 'web':
+        run_web_workers(Config().web_workers)
+    else:
+        asyncio.run(run_web())
+
+
 if __name__ == '__main__':
     directory = Path(__file__).resolve().parent
     sys.path.append(str(directory.parent))
     __package__ = str(directory.name)
 
-    asyncio.run(main(__package__))
+    main(__package__)
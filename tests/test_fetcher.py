@@ -0,0 +1,109 @@
+from datetime import datetime, timedelta, timezone
+from uuid import uuid4
+
+import pytest
+from tortoise import Tortoise
+
+from .. import db
+from ..db import Group, Message, Series, SeriesMessage
+from ..fetcher import get_or_create_group, normalize_subject, save_messages
+
+START = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+@pytest.fixture(autouse=True)
+async def database(tmp_path, monkeypatch):
+    monkeypatch.setattr(db, 'UPDATE_STAMP_PATH', tmp_path / 'update.stamp')
+    await Tortoise.init(db_url='sqlite://:memory:', modules={'models': [db.__name__]})
+    await Tortoise.generate_schemas()
+    yield
+    await Tortoise.close_connections()
+
+
+def make_message(group: Group, subject: str, minutes: int, reply_to: Message | None = None,
+                 sender: str = 'Alice <alice@example.com>') -> Message:
+    return Message(
+        id=uuid4(),
+        group=group,
+        msg_id=f'<{uuid4()}@example.com>',
+        reply_to=reply_to.msg_id if reply_to else None,
+        sender=sender,
+        subject=subject,
+        subject_normalized=normalize_subject(subject),
+        headers='',
+        body='',
+        created=START + timedelta(minutes=minutes),
+    )
+
+
+def make_version(group: Group, version: int, minutes: int) -> list[Message]:
+    cover = make_message(group, f'[PATCH v{version} 0/3] rust: Foo subsystem', minutes)
+    patches = [
+        make_message(group, f'[PATCH v{version} {index}/3] {title}', minutes + index, reply_to=cover)
+        for index, title in enumerate(['rust: add foo', 'rust: add bar', 'rust: docs'], start=1)
+    ]
+    return [cover, *patches]
+
+
+async def test_series_versions() -> None:
+    group = await get_or_create_group('test')
+    v2 = make_version(group, 2, 0)
+    await save_messages(v2, [])
+    v3 = make_version(group, 3, 60)
+    # patches are fetched before their cover letter
+    await save_messages(v3[1:] + v3[:1], [])
+
+    series = await Series.all()
+    assert len(series) == 1
+    assert series[0].subject == 'rust: Foo subsystem'
+    assert series[0].version == 3
+
+    series_messages = await SeriesMessage.filter(series=series[0]).order_by('version', 'index')
+    assert [(item.version, item.index) for item in series_messages] == [
+        (2, 0), (2, 1), (2, 2), (2, 3),
+        (3, 0), (3, 1), (3, 2), (3, 3),
+    ]
+    for item in series_messages:
+        cover = v2[0] if item.version == 2 else v3[0]
+        assert item.cover_msg_id == cover.msg_id
+
+
+async def test_cover_letter_after_patches() -> None:
+    group = await get_or_create_group('test')
+    await save_messages(make_version(group, 1, 0), [])
+    v2 = make_version(group, 2, 60)
+    # patches and their cover letter are fetched in separate batches
+    await save_messages(v2[2:], [])
+    await save_messages(v2[1:2], [])
+    await save_messages(v2[:1], [])
+
+    series = await Series.all()
+    assert len(series) == 1
+    assert series[0].version == 2
+
+    series_messages = await SeriesMessage.filter(series=series[0], version=2).order_by('index')
+    assert [item.index for item in series_messages] == [0, 1, 2, 3]
+    assert all(item.cover_msg_id == v2[0].msg_id for item in series_messages)
+
+
+async def test_patches_without_cover_letter() -> None:
+    group = await get_or_create_group('test')
+    first = make_message(group, '[PATCH 1/2] rust: add foo', 0)
+    second = make_message(group, '[PATCH 2/2] rust: add bar', 1, reply_to=first)
+    await save_messages([first, second], [])
+
+    series = await Series.all()
+    assert len(series) == 1
+    assert series[0].subject == 'rust: add foo'
+    assert await SeriesMessage.filter(series=series[0], cover_msg_id=None).count() == 2
+
+
+async def test_unrelated_single_patches() -> None:
+    group = await get_or_create_group('test')
+    await save_messages([make_message(group, '[PATCH] fix typo', 0)], [])
+    await save_messages([make_message(group, '[PATCH] fix typo', 60)], [])
+    await save_messages([make_message(group, '[PATCH v2] fix typo', 120)], [])
+
+    series = await Series.all().order_by('created')
+    assert [item.version for item in series] == [1, 2]
+    assert await SeriesMessage.filter(series=series[1]).count() == 2
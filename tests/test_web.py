@@ -0,0 +1,54 @@
+import pytest
+from fastapi import HTTPException
+
+from .. import db, web
+
+
+@pytest.fixture(autouse=True)
+def update_stamp(tmp_path, monkeypatch):
+    monkeypatch.setattr(db, 'UPDATE_STAMP_PATH', tmp_path / 'update.stamp')
+    monkeypatch.setattr(web, 'cache', web.OrderedDict())
+    monkeypatch.setattr(web, 'cache_stamp', '')
+    monkeypatch.setattr(web.app.state, 'read_only', False)
+
+
+class Loader:
+    def __init__(self) -> None:
+        self.calls = 0
+
+    async def __call__(self) -> int:
+        self.calls += 1
+        return self.calls
+
+
+async def test_cached_reloads_after_update() -> None:
+    load = Loader()
+    assert await web.cached('key', load) == 1
+    assert await web.cached('key', load) == 1
+
+    db.mark_updated()
+    assert await web.cached('key', load) == 2
+    assert await web.cached('key', load) == 2
+
+    db.mark_updated()
+    assert await web.cached('key', load) == 3
+
+
+async def test_cached_evicts_oldest(monkeypatch) -> None:
+    monkeypatch.setattr(web, 'CACHE_MAX_SIZE', 2)
+    loaders = {key: Loader() for key in ('a', 'b', 'c')}
+    await web.cached('a', loaders['a'])
+    await web.cached('b', loaders['b'])
+    await web.cached('a', loaders['a'])  # 'b' becomes the oldest
+    await web.cached('c', loaders['c'])
+
+    assert list(web.cache) == ['a', 'c']
+    await web.cached('a', loaders['a'])
+    assert loaders['a'].calls == 1
+
+
+async def test_read_only_app_rejects_update() -> None:
+    web.read_only_app()
+    with pytest.raises(HTTPException) as exc_info:
+        await web.handler_test()
+    assert exc_info.value.status_code == 403
@@ -4,30 +4,85 @@ import http
 import logging
 import quopri
 import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable
 
 import uvicorn
-from fastapi import FastAPI, Request
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.templating import Jinja2Templates
+from tortoise.functions import Count
 
-from .config import Config
-from .db import Group, Thread
-from .fetcher import update_messages
+from .config import Config, setup_logging
+from .db import Group, Message, MessageAuthor, Series, SeriesMessage, Thread, close_db, get_update_stamp, init_db
+from .fetcher import normalize_address, scheduled_update, update_messages
 
-app = FastAPI(openapi_url=None)
+# cached pages hold only lists and message headers, never message bodies
+CACHE_MAX_SIZE = 1000
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    setup_logging()
+    read_only = app.state.read_only
+    await init_db(__package__, read_only=read_only)
+    bg_task = None if read_only else asyncio.create_task(scheduled_update())
+    try:
+        yield
+    finally:
+        if bg_task:
+            bg_task.cancel()
+            try:
+                await bg_task
+            except asyncio.CancelledError:
+                pass
+        await close_db()
+
+
+app = FastAPI(openapi_url=None, lifespan=lifespan)
+app.state.read_only = False
 config = Config()
 templates = Jinja2Templates(directory="templates")
+templates.env.filters['address'] = normalize_address
+
+cache: OrderedDict[str, Any] = OrderedDict()
+cache_stamp = ''
+
+
+async def cached(key: str, load: Callable[[], Awaitable[Any]]) -> Any:
+    """Return value from in-process LRU cache, dropped whenever db update stamp changes."""
+    global cache_stamp
+    stamp = get_update_stamp()
+    if stamp != cache_stamp:
+        cache.clear()
+        cache_stamp = stamp
+    if key in cache:
+        cache.move_to_end(key)
+        return cache[key]
+    value = await load()
+    cache[key] = value
+    while len(cache) > CACHE_MAX_SIZE:
+        cache.popitem(last=False)
+    return value
 
 
 @app.get("/")
 async def read_root(request: Request):
-    groups = await Group.all().order_by("name")
+    async def load():
+        return await Group.all().order_by("name")
+
+    groups = await cached('groups', load)
     return templates.TemplateResponse("index.html", {"request": request, "groups": groups})
 
 
 @app.get("/groups/{group_id}")
 async def read_group(request: Request, group_id: str):
-    group = await Group.get(id=group_id)
-    threads = await group.threads.order_by("-updated").limit(100).prefetch_related("messages")
+    async def load():
+        group = await Group.get(id=group_id)
+        threads = await group.threads.order_by("-updated").limit(100).annotate(messages_count=Count("messages"))
+        return group, threads
+
+    group, threads = await cached(f'group:{group_id}', load)
     return templates.TemplateResponse("group.html", {"request": request, "group": group, "threads": threads})
 
 
@@ -42,24 +97,71 @@ async def read_thread(request: Request, thread_id: str):
                 message.body = quopri.decodestring(message.body).decode()
             elif encoding == 'base64':
                 message.body = base64.b64decode(message.body).decode()
-    return templates.TemplateResponse("thread.html", {"request": request, "thread": thread, "messages": messages})
+    series_ids = await SeriesMessage.filter(
+        message_id__in=[message.id for message in messages],
+    ).distinct().values_list("series_id", flat=True)
+    series = await Series.filter(id__in=series_ids).order_by("-updated")
+    return templates.TemplateResponse(
+        "thread.html",
+        {"request": request, "thread": thread, "messages": messages, "series": series},
+    )
+
+
+@app.get("/series/{series_id}")
+async def read_series(request: Request, series_id: str):
+    async def load():
+        series = await Series.get(id=series_id).prefetch_related("group")
+        series_messages = await series.messages.order_by("-version", "index")
+        messages = await Message.filter(
+            id__in=[series_message.message_id for series_message in series_messages],
+        ).only("id", "thread_id", "subject")
+        versions: dict[int, list[SeriesMessage]] = {}
+        for series_message in series_messages:
+            versions.setdefault(series_message.version, []).append(series_message)
+        return series, versions, {message.id: message for message in messages}
+
+    series, versions, messages = await cached(f'series:{series_id}', load)
+    return templates.TemplateResponse(
+        "series.html",
+        {"request": request, "series": series, "versions": versions, "messages": messages},
+    )
+
+
+@app.get("/authors/{address}")
+async def read_author(request: Request, address: str):
+    address = normalize_address(address)
+
+    async def load():
+        series = await Series.filter(sender_address=address).order_by("-updated").limit(100)
+        message_ids = await MessageAuthor.filter(address=address).order_by("-created").limit(100).values_list(
+            "message_id",
+            flat=True,
+        )
+        messages = await Message.filter(id__in=message_ids).order_by("-created").only(
+            "id", "thread_id", "subject", "created",
+        )
+        return series, messages
+
+    series, messages = await cached(f'author:{address}', load)
+    return templates.TemplateResponse(
+        "author.html",
+        {"request": request, "address": address, "series": series, "messages": messages},
+    )
 
 
 @app.get("/update")
 async def handler_test():
+    if app.state.read_only:
+        raise HTTPException(status_code=403, detail='Updates are done by separate fetch process')
     config = Config()
     await update_messages(config.groups, config.fetch_new_count, config.fetch_count)
     return 'done'
 
 
-async def scheduled_update() -> None:
-    config = Config()
-    while True:
-        try:
-            await update_messages(config.groups, config.fetch_new_count, config.fetch_count)
-        except Exception as e:
-            logging.error(f'Error during scheduled update: {e!r}')
-        await asyncio.sleep(config.fetch_interval_minutes * 60)
+def read_only_app() -> FastAPI:
+    """App factory for web workers, which only read db (writes are done by `main.py fetch`)."""
+    app.state.read_only = True
+    return app
 
 
 @app.middleware("http")
@@ -83,14 +185,18 @@ async def uvicorn_log_middleware(request: Request, call_next):
 
 
 async def run_web() -> None:
-    bg_task = asyncio.create_task(scheduled_update())
     uvicorn_config = uvicorn.Config(app, host="0.0.0.0", port=8080, access_log=False, log_config=None)
     uvicorn_server = uvicorn.Server(uvicorn_config)
-    try:
-        await uvicorn_server.serve()
-    finally:
-        bg_task.cancel()
-        try:
-            await bg_task
-        except asyncio.CancelledError:
-            pass
+    await uvicorn_server.serve()
+
+
+def run_web_workers(workers: int) -> None:
+    uvicorn.run(
+        f'{__package__}.web:read_only_app',
+        factory=True,
+        host="0.0.0.0",
+        port=8080,
+        workers=workers,
+        access_log=False,
+        log_config=None,
+    )